@@ -13,8 +13,8 @@ def run_query(graph, config, query: str, auto_approve: bool = False) -> str:
     """Run a query through the graph, optionally auto-approving sensitive calls."""
     result = graph.invoke({"messages": [HumanMessage(content=query)]}, config)
 
-    state = graph.get_state(config)
-    while state.next:
+    # Pending interrupts are reported on the result; no checkpoint re-read needed
+    while result.get("__interrupt__"):
         if auto_approve:
             decision = "approve"
             print("  [auto-approving sensitive tool call for demo]")
@@ -23,7 +23,6 @@ def run_query(graph, config, query: str, auto_approve: bool = False) -> str:
             print("  [auto-rejecting sensitive tool call for demo]")
 
         result = graph.invoke(Command(resume=decision), config)
-        state = graph.get_state(config)
 
     return result["messages"][-1].content if result["messages"] else ""
 
@@ -1,18 +1,21 @@
 """Medical assistant agent with human-in-the-loop approval for sensitive operations."""
 
+import asyncio
 import json
 import os
+import re
 import sys
 import uuid
+from functools import lru_cache
 
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.types import Command
 
 from database import search_patients, get_patient, delete_patient
+from http_clients import openai_http_clients
 from human_approval import build_graph
 from pii_middleware import pii_redact_tool, redact_pii
 
@@ -52,27 +55,42 @@ def delete_record(patient_id: str) -> str:
     return f"No patient found with ID {patient_id}."
 
 
+_LITERATURE = {
+    "diabetes": "Recent studies (2024) show GLP-1 receptor agonists reduce cardiovascular risk in T2DM patients. ADA recommends HbA1c target <7% for most adults.",
+    "hypertension": "2024 ACC/AHA guidelines recommend BP target <130/80 mmHg. First-line agents: ACE inhibitors, ARBs, CCBs, thiazide diuretics.",
+    "asthma": "GINA 2024 update: Low-dose ICS-formoterol as preferred reliever for mild asthma. Step-up therapy based on symptom control.",
+    "anxiety": "CBT remains first-line for GAD. SSRIs/SNRIs are first-line pharmacotherapy. Buspirone is an alternative.",
+    "migraine": "CGRP monoclonal antibodies (erenumab, fremanezumab) show efficacy for prophylaxis. Acute treatment: triptans, gepants.",
+}
+
+# One alternation over the topics so a query is scanned once, not once per topic
+_LITERATURE_RE = re.compile("|".join(map(re.escape, _LITERATURE)))
+
+
 @tool
 def search_medical_literature(query: str) -> str:
     """Search medical literature databases for research papers and clinical guidelines."""
-    canned_results = {
-        "diabetes": "Recent studies (2024) show GLP-1 receptor agonists reduce cardiovascular risk in T2DM patients. ADA recommends HbA1c target <7% for most adults.",
-        "hypertension": "2024 ACC/AHA guidelines recommend BP target <130/80 mmHg. First-line agents: ACE inhibitors, ARBs, CCBs, thiazide diuretics.",
-        "asthma": "GINA 2024 update: Low-dose ICS-formoterol as preferred reliever for mild asthma. Step-up therapy based on symptom control.",
-        "anxiety": "CBT remains first-line for GAD. SSRIs/SNRIs are first-line pharmacotherapy. Buspirone is an alternative.",
-        "migraine": "CGRP monoclonal antibodies (erenumab, fremanezumab) show efficacy for prophylaxis. Acute treatment: triptans, gepants.",
-    }
-    query_lower = query.lower()
-    for key, result in canned_results.items():
-        if key in query_lower:
-            return result
+    match = _LITERATURE_RE.search(query.lower())
+    if match:
+        return _LITERATURE[match.group()]
     return f"Found 3 review articles on '{query}'. Key finding: further research is needed. Consult specialist guidelines for clinical decisions."
 
 
 # --- Agent setup ---
 
 def build_agent(pii_filter: bool = True):
-    """Build and return a LangGraph graph with human-in-the-loop approval."""
+    """Build and return a LangGraph graph with human-in-the-loop approval.
+
+    Cached per pii_filter value: repeat calls reuse the compiled graph (and its
+    checkpointer, which keeps conversations apart by thread_id).
+    """
+    return _build_agent(bool(pii_filter))
+
+
+# Keyed on the normalised flag alone, so build_agent(), build_agent(True) and
+# build_agent(pii_filter=True) all share one graph
+@lru_cache(maxsize=2)
+def _build_agent(pii_filter: bool):
     raw_tools = [search_patient, send_email, delete_record, search_medical_literature]
 
     if pii_filter:
@@ -80,7 +98,10 @@ def build_agent(pii_filter: bool = True):
     else:
         agent_tools = raw_tools
 
-    llm = ChatOpenAI(model="gpt-4o", temperature=0)
+    # Imported here so modules that only need the tools skip the OpenAI client
+    from langchain_openai import ChatOpenAI
+
+    llm = ChatOpenAI(model="gpt-4o", temperature=0, **openai_http_clients())
     checkpointer = MemorySaver()
     graph = build_graph(agent_tools, llm, checkpointer)
     return graph
@@ -88,7 +109,26 @@ def build_agent(pii_filter: bool = True):
 
 # --- REPL ---
 
-def main():
+async def stream_turn(graph, graph_input, config) -> dict:
+    """Run the graph with astream, reporting tool calls as the agent makes them.
+
+    Returns the last state emitted, including "__interrupt__" when the run
+    paused for approval. The reply itself is only printed by the caller
+    once the output guardrail has cleared it, so LLM tokens are not streamed.
+    """
+    result = {"messages": []}
+    seen = None
+    async for result in graph.astream(graph_input, config, stream_mode="values"):
+        messages = result["messages"]
+        if seen is not None:
+            for msg in messages[seen:]:
+                if isinstance(msg, AIMessage) and msg.tool_calls:
+                    print(f"  [calling {', '.join(tc['name'] for tc in msg.tool_calls)}]")
+        seen = len(messages)
+    return result
+
+
+async def main():
     pii_filter = "--no-pii-filter" not in sys.argv
     graph = build_agent(pii_filter=pii_filter)
 
@@ -111,24 +151,21 @@ def main():
             print("Goodbye!")
             break
 
-        result = graph.invoke(
+        result = await stream_turn(
+            graph,
             {"messages": [HumanMessage(content=user_input)]},
             config,
         )
 
-        # Check if the graph is interrupted (waiting for approval)
-        state = graph.get_state(config)
-        while state.next:
-            # There's an interrupt — display pending tool calls for approval
-            pending = state.tasks
-            for task in pending:
-                if hasattr(task, "interrupts") and task.interrupts:
-                    for intr in task.interrupts:
-                        info = intr.value
-                        print(f"\n*** APPROVAL REQUIRED ***")
-                        print(f"  {info['message']}")
-                        for tc in info["tool_calls"]:
-                            print(f"  - {tc['name']}({tc['args']})")
+        # The last streamed state carries any pending approval interrupts
+        interrupts = result.get("__interrupt__")
+        while interrupts:
+            for intr in interrupts:
+                info = intr.value
+                print(f"\n*** APPROVAL REQUIRED ***")
+                print(f"  {info['message']}")
+                for tc in info["tool_calls"]:
+                    print(f"  - {tc['name']}({tc['args']})")
 
             try:
                 answer = input("  Approve? (y/n): ").strip().lower()
@@ -137,10 +174,8 @@ def main():
                 return
 
             decision = "approve" if answer == "y" else "reject"
-            result = graph.invoke(Command(resume=decision), config)
-
-            # Check again in case of further interrupts
-            state = graph.get_state(config)
+            result = await stream_turn(graph, Command(resume=decision), config)
+            interrupts = result.get("__interrupt__")
 
         # Extract the final AI message
         final_msg = result["messages"][-1].content if result["messages"] else ""
@@ -149,4 +184,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -2,7 +2,7 @@
 
 from typing import List, Dict, Optional
 
-PATIENTS = [
+_SEED_PATIENTS = [
     {
         "id": "P001",
         "name": "John Smith",
@@ -78,27 +78,40 @@ PATIENTS = [
 ]
 
 
+def _search_key(patient: Dict) -> str:
+    """Lowercased name and diagnosis joined by a NUL separator, so queries can't span both fields."""
+    return f"{patient['name']}\0{patient['diagnosis']}".lower()
+
+
+# Indexes keyed by patient ID are the source of truth; dicts keep insertion
+# order, so iterating them gives the records in their original order
+PATIENTS_BY_ID: Dict[str, Dict] = {p["id"]: p for p in _SEED_PATIENTS}
+_SEARCH_KEYS: Dict[str, str] = {p["id"]: _search_key(p) for p in _SEED_PATIENTS}
+del _SEED_PATIENTS
+
+
+def __getattr__(name: str):
+    # PATIENTS is materialized from the index on access, so deletes stay O(1)
+    if name == "PATIENTS":
+        return list(PATIENTS_BY_ID.values())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def search_patients(query: str) -> List[Dict]:
     """Search patients by name or diagnosis (case-insensitive partial match)."""
     query_lower = query.lower()
-    return [
-        p for p in PATIENTS
-        if query_lower in p["name"].lower() or query_lower in p["diagnosis"].lower()
-    ]
+    return [PATIENTS_BY_ID[pid] for pid, key in _SEARCH_KEYS.items() if query_lower in key]
 
 
 def get_patient(patient_id: str) -> Optional[Dict]:
     """Get a single patient by ID."""
-    for p in PATIENTS:
-        if p["id"] == patient_id:
-            return p
-    return None
+    return PATIENTS_BY_ID.get(patient_id)
 
 
 def delete_patient(patient_id: str) -> bool:
     """Delete a patient record by ID. Returns True if deleted, False if not found."""
-    for i, p in enumerate(PATIENTS):
-        if p["id"] == patient_id:
-            PATIENTS.pop(i)
-            return True
-    return False
+    patient = PATIENTS_BY_ID.pop(patient_id, None)
+    if patient is None:
+        return False
+    del _SEARCH_KEYS[patient_id]
+    return True
@@ -0,0 +1,36 @@
+"""Shared HTTP clients for the OpenAI chat models.
+
+The agent LLM and the output guardrail's safety LLM both talk to the OpenAI
+API; passing them the same clients lets their requests share one HTTP/2
+connection pool instead of each paying for its own TLS handshakes.
+"""
+
+import atexit
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def openai_http_clients() -> dict:
+    """Return ChatOpenAI http client kwargs sharing one HTTP/2 connection pool.
+
+    Without the optional `h2` package this returns {} and ChatOpenAI's default
+    (already shared, HTTP/1.1) clients are used.
+
+    The async client's connections belong to the event loop that first uses
+    them, so it assumes one loop per process, as in agent.py and
+    layered_guardrails.py (a single asyncio.run). Code that starts several
+    loops should build its own ChatOpenAI clients instead.
+    """
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return {}
+    import httpx
+
+    limits = httpx.Limits(max_keepalive_connections=20)
+    timeout = httpx.Timeout(60.0, connect=10.0)
+    client = httpx.Client(http2=True, limits=limits, timeout=timeout)
+    atexit.register(client.close)
+    # The async pool is released with the process; its event loop is gone by atexit time
+    async_client = httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+    return {"http_client": client, "http_async_client": async_client}
@@ -2,96 +2,173 @@
 
 Uses LangGraph's interrupt() to pause execution when the agent tries to call
 sensitive tools (send_email, delete_record), requiring explicit human approval
-before proceeding.
+before proceeding. Trusted sessions can set config["configurable"]["approval_mode"]
+to "approve_all" or "reject_all" to decide every call without interrupting.
 """
 
 from typing import Any
 
 from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool
 from langgraph.graph import StateGraph, MessagesState, END
 from langgraph.prebuilt import ToolNode
-from langgraph.types import interrupt, Command
+from langgraph.types import interrupt, Command, Send
 
 from input_guardrail import input_guard_node, route_after_guard
-from output_guardrail import build_output_guard_node, route_after_output_guard
+from output_guardrail import build_output_guard_node, route_after_output_guard, stream_screened
 
 
-SENSITIVE_TOOLS = {"send_email", "delete_record"}
+SENSITIVE_TOOLS = frozenset({"send_email", "delete_record"})
 
+# Appended to sensitive tools' descriptions so the LLM doesn't bundle them
+SOLO_CALL_NOTE = (
+    " Requires human approval: always call this tool on its own, never in the "
+    "same turn as other tool calls."
+)
 
-def agent_node(state: MessagesState, llm_with_tools: Any) -> dict:
-    """Invoke the LLM and return its response."""
-    response = llm_with_tools.invoke(state["messages"])
+# Session-level approval_mode values and the decision each one stands for
+APPROVAL_MODES = {"approve_all": "approve", "reject_all": "reject"}
+
+
+def _unanswered_tool_calls(messages: list) -> set:
+    """IDs of tool calls in the latest tool-calling AIMessage that have no ToolMessage yet."""
+    answered = set()
+    for msg in reversed(messages):
+        if isinstance(msg, ToolMessage):
+            answered.add(msg.tool_call_id)
+        elif isinstance(msg, AIMessage) and msg.tool_calls:
+            return {tc["id"] for tc in msg.tool_calls} - answered
+        else:
+            break
+    return set()
+
+
+def agent_node(state: MessagesState, llm_with_tools: Any, safety_classifier=None) -> dict:
+    """Invoke the LLM and return its response.
+
+    ToolNode and the approval gate return every ToolMessage of a batch in a
+    single update, so the LLM answers a whole batch in one call rather than
+    one call per tool. The assertion guards that invariant.
+
+    With a safety classifier the reply is streamed and screened sentence by
+    sentence, so a clearly unsafe answer is cut off before it finishes decoding.
+    """
+    messages = state["messages"]
+    assert not _unanswered_tool_calls(messages), "agent ran before every tool call in the batch was answered"
+    if safety_classifier is not None:
+        response = stream_screened(llm_with_tools, messages, safety_classifier)
+    else:
+        response = llm_with_tools.invoke(messages)
     return {"messages": [response]}
 
 
 def approval_check(state: MessagesState) -> Command:
-    """Gate node: interrupt for approval if the last message contains sensitive tool calls."""
+    """Route tool calls: safe calls go straight to tools, sensitive ones through the approval gate."""
     last = state["messages"][-1]
     if not isinstance(last, AIMessage) or not last.tool_calls:
         return Command(goto="tools")
 
-    sensitive_calls = [tc for tc in last.tool_calls if tc["name"] in SENSITIVE_TOOLS]
-
-    if not sensitive_calls:
+    if SENSITIVE_TOOLS.isdisjoint(tc["name"] for tc in last.tool_calls):
         # All calls are safe — proceed directly to tool execution
         return Command(goto="tools")
 
-    # Interrupt and present the sensitive calls for human review
-    decision = interrupt({
-        "message": "Sensitive tool call(s) detected. Approve?",
-        "tool_calls": [
-            {"id": tc["id"], "name": tc["name"], "args": tc["args"]}
-            for tc in sensitive_calls
-        ],
-    })
+    safe_calls = [tc for tc in last.tool_calls if tc["name"] not in SENSITIVE_TOOLS]
+    if not safe_calls:
+        return Command(goto="approval_gate")
 
-    if decision == "approve":
-        return Command(goto="tools")
+    # Mixed batch — run the safe calls now, alongside the approval gate, instead
+    # of holding them until a human has decided on the sensitive ones
+    return Command(goto=[
+        Send("tools_safe", {"messages": [AIMessage(content="", tool_calls=safe_calls)]}),
+        "approval_gate",
+    ])
 
-    # Rejected — return ToolMessages so the LLM knows the calls were denied
-    rejection_msgs = []
-    for tc in last.tool_calls:
-        if tc["name"] in SENSITIVE_TOOLS:
-            rejection_msgs.append(
-                ToolMessage(
-                    content=f"Tool call '{tc['name']}' was rejected by the user.",
-                    tool_call_id=tc["id"],
-                )
-            )
+
+def build_approval_gate_node(tool_node: ToolNode):
+    """Return an approval_gate node closure that runs approved calls with tool_node."""
+
+    def approval_gate(state: MessagesState, config: RunnableConfig) -> dict:
+        """Interrupt for approval of the sensitive tool calls in the last message."""
+        last = state["messages"][-1]
+        sensitive_calls = [tc for tc in last.tool_calls if tc["name"] in SENSITIVE_TOOLS]
+
+        # A session-wide decision skips the interrupt and its checkpoint round-trip
+        approval_mode = config.get("configurable", {}).get("approval_mode")
+        if approval_mode in APPROVAL_MODES:
+            decision = APPROVAL_MODES[approval_mode]
         else:
-            # Let safe calls that were bundled with sensitive ones also get rejected
-            # so the ToolNode doesn't receive a partial set.
-            rejection_msgs.append(
-                ToolMessage(
-                    content=f"Tool call '{tc['name']}' was skipped because the batch was rejected.",
-                    tool_call_id=tc["id"],
-                )
+            # Interrupt and present the sensitive calls for human review
+            decision = interrupt({
+                "message": "Sensitive tool call(s) detected. Approve?",
+                "tool_calls": [
+                    {"id": tc["id"], "name": tc["name"], "args": tc["args"]}
+                    for tc in sensitive_calls
+                ],
+            })
+
+        if decision == "approve":
+            return tool_node.invoke(
+                {"messages": [AIMessage(content="", tool_calls=sensitive_calls)]},
+                config,
             )
-    return Command(goto="agent", update={"messages": rejection_msgs})
 
+        # Rejected — return ToolMessages so the LLM knows the calls were denied
+        return {"messages": [
+            ToolMessage(
+                content=f"Tool call '{tc['name']}' was rejected by the user.",
+                tool_call_id=tc["id"],
+            )
+            for tc in sensitive_calls
+        ]}
+
+    return approval_gate
 
-def build_graph(tools, llm, checkpointer):
+
+def mark_sensitive_tool(tool: BaseTool) -> BaseTool:
+    """Return a copy of a sensitive tool whose description asks the LLM to call it alone.
+
+    Keeping sensitive calls out of mixed batches means the approval gate rarely
+    has to split a batch or hold safe calls back.
+    """
+    if tool.name not in SENSITIVE_TOOLS:
+        return tool
+    return tool.model_copy(update={"description": tool.description + SOLO_CALL_NOTE})
+
+
+def build_graph(tools, llm, checkpointer, safety_classifier=None, safety_embeddings=None, safety_llm=None):
     """Build and compile the LangGraph StateGraph with an approval gate.
 
     Args:
         tools: list of LangChain tools to bind to the LLM
         llm: ChatOpenAI (or compatible) instance
         checkpointer: a LangGraph checkpointer (e.g. MemorySaver)
+        safety_classifier: optional local classifier tried before the LLM
+            safety evaluation (e.g. DistilBertSafetyClassifier); also screens
+            the agent's reply sentence by sentence while it streams
+        safety_embeddings: optional LangChain Embeddings model that lets the
+            output guardrail reuse verdicts for near-identical responses
+        safety_llm: LLM for the output guardrail's safety evaluation; defaults
+            to build_safety_llm() (gpt-4o-mini in JSON mode)
 
     Returns:
         Compiled LangGraph graph
     """
+    tools = [mark_sensitive_tool(t) for t in tools]
     llm_with_tools = llm.bind_tools(tools)
 
+    tool_node = ToolNode(tools)
+
     graph = StateGraph(MessagesState)
 
     # Nodes
     graph.add_node("input_guard", input_guard_node)
-    graph.add_node("agent", lambda state: agent_node(state, llm_with_tools))
-    graph.add_node("output_guard", build_output_guard_node(llm))
+    graph.add_node("agent", lambda state: agent_node(state, llm_with_tools, safety_classifier))
+    graph.add_node("output_guard", build_output_guard_node(safety_llm, safety_classifier, safety_embeddings))
     graph.add_node("approval_check", approval_check)
-    graph.add_node("tools", ToolNode(tools))
+    graph.add_node("approval_gate", build_approval_gate_node(tool_node))
+    graph.add_node("tools", tool_node)
+    graph.add_node("tools_safe", tool_node)
 
     # Edges
     graph.set_entry_point("input_guard")
@@ -99,5 +176,8 @@ def build_graph(tools, llm, checkpointer):
     graph.add_edge("agent", "output_guard")
     graph.add_conditional_edges("output_guard", route_after_output_guard, {"approval_check": "approval_check", END: END})
     graph.add_edge("tools", "agent")
+    # Both branches of a mixed batch finish in the same step, so the agent runs once
+    graph.add_edge("tools_safe", "agent")
+    graph.add_edge("approval_gate", "agent")
 
     return graph.compile(checkpointer=checkpointer)
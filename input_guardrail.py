@@ -5,21 +5,66 @@ Applies two checks:
 2. Medical scope check — rejects off-topic requests unrelated to medical/patient tasks
 """
 
-import re
+from enum import Enum
+from functools import lru_cache
+from re import IGNORECASE
 from typing import NamedTuple
 
 from langchain_core.messages import AIMessage, HumanMessage
 from langgraph.graph import MessagesState, END
 
+try:
+    import re2 as re  # linear-time engine, immune to catastrophic backtracking
+except ImportError:
+    import re
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class Verdict(Enum):
+    """Which check decided the outcome, so callers need not inspect the reason text."""
+    PASS = "pass"
+    BLOCK_PATTERN = "block_pattern"
+    BLOCK_SCOPE = "block_scope"
+
 
 class GuardrailResult(NamedTuple):
     allowed: bool
     reason: str
+    verdict: Verdict = Verdict.PASS
+
+
+def _build_keyword_automaton(keywords):
+    """Build an Aho–Corasick automaton over keywords, or None if pyahocorasick is missing."""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for kw in keywords:
+        automaton.add_word(kw, kw)
+    automaton.make_automaton()
+    return automaton
+
+
+def _build_blocklist_regex(patterns):
+    """Combine compiled patterns into one alternation, keeping each one's case-insensitivity."""
+    parts = []
+    for pattern in patterns:
+        source = pattern.pattern
+        if source.startswith("(?i)"):
+            source, ignore_case = source[4:], True
+        else:
+            ignore_case = bool(getattr(pattern, "flags", 0) & IGNORECASE)
+        parts.append(f"(?i:{source})" if ignore_case else f"(?:{source})")
+    return re.compile("|".join(parts))
 
 
 class InputGuardrail:
-    BLOCKED_PATTERNS = [
-        re.compile(p, re.IGNORECASE)
+    # Inline (?i) rather than re.IGNORECASE so the patterns compile under RE2 too
+    BLOCKED_PATTERNS = tuple(
+        re.compile("(?i)" + p)
         for p in [
             r"ignore.*instructions",
             r"disregard.*prompt",
@@ -31,45 +76,83 @@ class InputGuardrail:
             r"act\s+as\s+(root|admin)",
             r"reveal.*system\s*prompt",
         ]
-    ]
+    )
 
-    MEDICAL_KEYWORDS = {
+    MEDICAL_KEYWORDS = frozenset({
         "patient", "diagnosis", "medication", "prescri", "treatment",
         "doctor", "medical", "health", "symptom", "clinical",
         "record", "email", "search", "literature", "hospital",
         "drug", "therapy", "lab", "test", "nurse", "vital",
         "allergy", "condition", "history", "refer",
-    }
+    })
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Subclasses may override the tables above; rebuild the matchers from theirs
+        cls._compile_tables()
+
+    @classmethod
+    def _compile_tables(cls) -> None:
+        # The blocklist is checked in one scan of the input, and any keyword is
+        # found in a single pass instead of one substring scan per keyword
+        cls.BLOCKLIST_RE = _build_blocklist_regex(cls.BLOCKED_PATTERNS)
+        cls._KEYWORD_AUTOMATON = _build_keyword_automaton(cls.MEDICAL_KEYWORDS)
+        cls._KEYWORD_RE = re.compile("(?i)" + "|".join(re.escape(kw) for kw in sorted(cls.MEDICAL_KEYWORDS)))
+
+    @classmethod
+    def _has_medical_keyword(cls, text: str) -> bool:
+        if cls._KEYWORD_AUTOMATON is not None:
+            # The automaton is case-sensitive, so it scans a lowercased copy
+            return next(cls._KEYWORD_AUTOMATON.iter(text.lower()), None) is not None
+        # The case-insensitive fallback regex needs no lowercased copy
+        return cls._KEYWORD_RE.search(text) is not None
 
     def check(self, user_input: str) -> GuardrailResult:
+        # The verdict depends only on the text, so repeated inputs (demo reruns,
+        # resumed graphs) skip the scans; see _check_cached.cache_info() for hits
+        return self._check_cached(user_input)
+
+    @classmethod
+    @lru_cache(maxsize=2048)
+    def _check_cached(cls, user_input: str) -> GuardrailResult:
         # 1. Blocklist check
-        for pattern in self.BLOCKED_PATTERNS:
-            if pattern.search(user_input):
-                return GuardrailResult(
-                    allowed=False,
-                    reason="Your request was blocked because it matched a restricted pattern. Please rephrase.",
-                )
+        if cls.BLOCKLIST_RE.search(user_input):
+            return GuardrailResult(
+                allowed=False,
+                reason="Your request was blocked because it matched a restricted pattern. Please rephrase.",
+                verdict=Verdict.BLOCK_PATTERN,
+            )
 
         # 2. Medical scope check
-        lower = user_input.lower()
-        if any(kw in lower for kw in self.MEDICAL_KEYWORDS):
-            return GuardrailResult(allowed=True, reason="")
+        if cls._has_medical_keyword(user_input):
+            return GuardrailResult(allowed=True, reason="", verdict=Verdict.PASS)
 
         return GuardrailResult(
             allowed=False,
             reason="I can only help with medical and patient-related requests. Your message appears to be off-topic.",
+            verdict=Verdict.BLOCK_SCOPE,
         )
 
 
+InputGuardrail._compile_tables()
+
+# The guardrail holds no per-call state, so one instance serves every graph tick
+_GUARD = InputGuardrail()
+
+
 def input_guard_node(state: MessagesState) -> dict:
     """Graph node that runs the input guardrail on the latest human message."""
-    # Find the last HumanMessage
-    for msg in reversed(state["messages"]):
-        if isinstance(msg, HumanMessage):
-            result = InputGuardrail().check(msg.content)
-            if not result.allowed:
-                return {"messages": [AIMessage(content=result.reason)]}
-            return state
+    messages = state["messages"]
+    # The guard is the entry point, so the new user input is normally the last message
+    last = messages[-1] if messages else None
+    if not isinstance(last, HumanMessage):
+        last = next((m for m in reversed(messages) if isinstance(m, HumanMessage)), None)
+    if last is None:
+        return state
+
+    result = _GUARD.check(last.content)
+    if not result.allowed:
+        return {"messages": [AIMessage(content=result.reason)]}
     return state
 
 
@@ -3,14 +3,35 @@
 Evaluates the agent's final text responses for safety issues such as harmful
 medical advice, hallucinated treatments, self-harm instructions, or unauthorized
 disclosures. Blocks unsafe responses with a refusal message.
+
+Cheap rule checks (and an optional local classifier) are combined into a
+weighted compliance score first; the LLM is only consulted when that score
+is inconclusive.
 """
 
 import json
-from typing import NamedTuple
+import math
+import operator
+import threading
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Optional, Tuple
 
-from langchain_core.messages import AIMessage, SystemMessage, HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, message_chunk_to_message
 from langgraph.graph import MessagesState, END
 
+from http_clients import openai_http_clients
+from pii_middleware import redact_pii
+
+try:
+    import re2 as re  # linear-time engine, immune to catastrophic backtracking
+except ImportError:
+    import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class GuardrailResult(NamedTuple):
     allowed: bool
@@ -40,27 +61,284 @@ or
 {"safe": false, "reason": "brief explanation of the safety concern"}"""
 
 
+_UNPARSEABLE = GuardrailResult(
+    allowed=False,
+    reason="Safety check produced an unparseable response; blocked as a precaution.",
+)
+
+# A binary safe/unsafe verdict doesn't need a frontier model
+SAFETY_MODEL = "gpt-4o-mini"
+
+
+def build_safety_llm():
+    """Return the default evaluator LLM: a small model in JSON mode with a short reply budget."""
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=SAFETY_MODEL,
+        temperature=0,
+        max_tokens=128,
+        model_kwargs={"response_format": {"type": "json_object"}},
+        **openai_http_clients(),
+    )
+
+
+# --- Rule-based compliance checks ---
+#
+# Each check scores a response in [0, 1] (1 = compliant). The weighted mean
+# C = Σ w·g / Σ w decides without the LLM when it is clearly low or high.
+
+# A small, illustrative list of advice a medical assistant should never give.
+# It is not exhaustive (negations such as "never crush the tablets" also trip
+# it); anything it and the other rules can't settle goes to the LLM evaluator.
+_DISALLOWED_RE = re.compile(
+    "(?i)"
+    r"\b(?:crush|chew|split|break)(?:ing)? (?:the |your |these |those )?(?:tablets?|pills?|capsules?)"
+    r"|\b(?:no need|(?:you )?(?:do not|don't) need) to (?:see|consult|call|visit) "
+    r"(?:a |your )?(?:doctor|physician|clinician|pharmacist|professional)"
+    r"|\b(?:double|triple) (?:the|your) (?:dose|dosage)"
+    r"|\btake (?:an |a )?(?:extra|double) dose"
+    r"|\bwithout (?:a )?prescription"
+    r"|\b(?:combine|mix|take) (?:it|them|this|these) with "
+    r"(?:alcohol|benzodiazepines|opioids|sedatives|sleeping pills)"
+)
+_DOSAGE_RE = re.compile(r"(?i)\b\d+(?:\.\d+)?\s*(?:mg|mcg|g|ml|units?|iu)\b")
+# Guideline phrasing is matched case-insensitively; issuing bodies only as
+# upper-case acronyms, so everyday words like "who" or "ada" don't count
+_CITATION_RE = re.compile(
+    r"\b(?:(?i:guidelines?|according to)|ADA|AHA|ACC|GINA|WHO|CDC|FDA|NICE)\b"
+)
+
+
+def disallowed_terms(text: str) -> float:
+    return 0.0 if _DISALLOWED_RE.search(text) else 1.0
+
+
+def pii_present(text: str) -> float:
+    return 0.0 if redact_pii(text) != text else 1.0
+
+
+def dosage_without_citation(text: str) -> float:
+    if _DOSAGE_RE.search(text) and not _CITATION_RE.search(text):
+        return 0.0
+    return 1.0
+
+
+COMPLIANCE_RULES = (
+    (disallowed_terms, 3.0),
+    (dosage_without_citation, 2.0),
+    (pii_present, 1.0),
+)
+
+# Weight of a local classifier's P(safe); rules alone can only prove a
+# response unsafe, so the LLM-free allow path needs the classifier's vote
+CLASSIFIER_WEIGHT = 6.0
+
+# A classifier this sure a text is unsafe blocks it outright, both for full
+# responses and for sentences screened while the reply streams
+CLASSIFIER_BLOCK_CONFIDENCE = 0.95
+
+COMPLIANT_ABOVE = 0.95
+NONCOMPLIANT_BELOW = 0.2
+
+
+class DistilBertSafetyClassifier:
+    """Local safe/unsafe classifier backed by a fine-tuned DistilBERT checkpoint.
+
+    Requires the optional `transformers` and `torch` packages. The model is
+    dynamically quantized to INT8 so CPU inference stays cheap.
+    """
+
+    def __init__(self, model_name_or_path: str, unsafe_label: int = 1):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        self._torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name_or_path)
+        model.eval()
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.unsafe_label = unsafe_label
+
+    def __call__(self, text: str) -> Tuple[bool, float]:
+        """Return (is_safe, confidence) for the given response text."""
+        inputs = self.tokenizer(text, truncation=True, return_tensors="pt")
+        with self._torch.no_grad():
+            probs = self._torch.softmax(self.model(**inputs).logits, dim=-1)[0]
+        unsafe = probs[self.unsafe_label].item()
+        return unsafe < 0.5, max(unsafe, 1 - unsafe)
+
+
+# Without numpy each cached vector costs one Python multiply per dimension
+# (~1.5M for 1024 × 1536-dim entries), so the fallback keeps far fewer of them
+PURE_PYTHON_SEMANTIC_LIMIT = 64
+
+
+class _SemanticCache:
+    """Ring buffer of (unit embedding, verdict) pairs searched by cosine similarity.
+
+    With numpy the vectors live in one preallocated matrix and a lookup is a
+    single matrix-vector product; otherwise it is a capped pure-Python scan.
+    Not thread-safe; OutputGuardrail holds its lock around every call.
+    """
+
+    def __init__(self, capacity: int, threshold: float):
+        self.threshold = threshold
+        if np is None:
+            capacity = min(capacity, PURE_PYTHON_SEMANTIC_LIMIT)
+        self._capacity = capacity
+        self._results: List[Optional[GuardrailResult]] = [None] * capacity
+        self._vectors = None if np is not None else [None] * capacity
+        self._size = 0
+        self._next = 0
+
+    @staticmethod
+    def normalize(vector: List[float]):
+        if np is not None:
+            array = np.asarray(vector, dtype=np.float32)
+            return array / (np.linalg.norm(array) or 1.0)
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def lookup(self, vector) -> Optional[GuardrailResult]:
+        if not self._size:
+            return None
+        if np is not None:
+            similarities = self._vectors[:self._size] @ vector
+            best = int(similarities.argmax())
+            return self._results[best] if similarities[best] >= self.threshold else None
+        for cached, result in zip(self._vectors[:self._size], self._results):
+            if sum(map(operator.mul, vector, cached)) >= self.threshold:
+                return result
+        return None
+
+    def add(self, vector, result: GuardrailResult) -> None:
+        if not self._capacity:
+            return
+        if self._vectors is None:
+            self._vectors = np.empty((self._capacity, len(vector)), dtype=np.float32)
+        slot = self._next
+        self._vectors[slot] = vector
+        self._results[slot] = result
+        self._next = (slot + 1) % self._capacity
+        self._size = min(self._size + 1, self._capacity)
+
+
 class OutputGuardrail:
-    def __init__(self, llm):
-        self.llm = llm
+    def __init__(
+        self,
+        llm=None,
+        classifier: Optional[Callable[[str], Tuple[bool, float]]] = None,
+        embeddings=None,
+        cache_size: int = 1024,
+        similarity_threshold: float = 0.95,
+    ):
+        self.llm = llm if llm is not None else build_safety_llm()
+        self.classifier = classifier
+        # Optional LangChain Embeddings model enabling near-duplicate cache hits.
+        # Every exact-cache miss the rules can't settle then costs an embedding
+        # call plus a similarity scan over up to cache_size vectors (a matrix
+        # product with numpy, at most PURE_PYTHON_SEMANTIC_LIMIT without), so
+        # it only pays off when embeddings are much cheaper than the safety LLM
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        # Exact-text verdicts, least recently used first
+        self._exact: "OrderedDict[str, GuardrailResult]" = OrderedDict()
+        self._semantic = _SemanticCache(cache_size, similarity_threshold)
 
     def evaluate(self, response_text: str) -> GuardrailResult:
-        result = self.llm.invoke([
-            SystemMessage(content=SAFETY_PROMPT),
-            HumanMessage(content=f"Evaluate this assistant response:\n\n{response_text}"),
-        ])
+        return self.evaluate_many([response_text])[0]
+
+    def evaluate_many(self, responses: List[str]) -> List[GuardrailResult]:
+        """Evaluate several responses, sending every LLM check in one llm.batch() call.
+
+        Verdicts are looked up in an exact-text LRU cache, then (when embeddings
+        are configured) a cosine-similarity cache, before any LLM call is made.
+        """
+        results: List[Optional[GuardrailResult]] = [None] * len(responses)
+        pending = []
+        for i, response_text in enumerate(responses):
+            results[i] = self._lookup_exact(response_text) or self._score(response_text)
+            if results[i] is not None:
+                continue
+            vector = self._embed(response_text)
+            results[i] = self._lookup_semantic(vector)
+            if results[i] is None:
+                pending.append((i, vector))
+
+        if pending:
+            replies = self.llm.batch([
+                [
+                    SystemMessage(content=SAFETY_PROMPT),
+                    HumanMessage(content=f"Evaluate this assistant response:\n\n{responses[i]}"),
+                ]
+                for i, _ in pending
+            ])
+            for (i, vector), reply in zip(pending, replies):
+                results[i] = self._parse(reply.content)
+                # Don't pin a precautionary block; the next attempt may parse
+                if results[i] is not _UNPARSEABLE:
+                    self._remember(responses[i], vector, results[i])
+        return results
+
+    def _lookup_exact(self, response_text: str) -> Optional[GuardrailResult]:
+        with self._lock:
+            result = self._exact.get(response_text)
+            if result is not None:
+                self._exact.move_to_end(response_text)
+            return result
+
+    def _embed(self, response_text: str):
+        """Return the unit-length embedding of the text, or None without embeddings."""
+        if self.embeddings is None:
+            return None
+        return _SemanticCache.normalize(self.embeddings.embed_query(response_text))
+
+    def _lookup_semantic(self, vector) -> Optional[GuardrailResult]:
+        if vector is None:
+            return None
+        with self._lock:
+            return self._semantic.lookup(vector)
+
+    def _remember(self, response_text: str, vector, result: GuardrailResult) -> None:
+        with self._lock:
+            self._exact[response_text] = result
+            if len(self._exact) > self._cache_size:
+                self._exact.popitem(last=False)
+            if vector is not None:
+                self._semantic.add(vector, result)
+
+    def _score(self, response_text: str) -> Optional[GuardrailResult]:
+        """Return a verdict from the weighted compliance score, or None if it is inconclusive."""
+        scores = [(rule(response_text), weight, rule.__name__) for rule, weight in COMPLIANCE_RULES]
+        if self.classifier is not None:
+            is_safe, confidence = self.classifier(response_text)
+            if not is_safe and confidence >= CLASSIFIER_BLOCK_CONFIDENCE:
+                return GuardrailResult(allowed=False, reason="Failed compliance check: safety_classifier.")
+            scores.append((confidence if is_safe else 1 - confidence, CLASSIFIER_WEIGHT, "safety_classifier"))
+
+        compliance = sum(g * w for g, w, _ in scores) / sum(w for _, w, _ in scores)
+        if compliance < NONCOMPLIANT_BELOW:
+            # Lowest score wins; ties go to the heavier rule
+            weakest = min(scores, key=lambda s: (s[0], -s[1]))[2]
+            return GuardrailResult(allowed=False, reason=f"Failed compliance check: {weakest}.")
+        if self.classifier is not None and compliance > COMPLIANT_ABOVE:
+            return GuardrailResult(allowed=True, reason="Passed rule and classifier compliance checks.")
+        return None
+
+    @staticmethod
+    def _parse(content: str) -> GuardrailResult:
         try:
-            parsed = json.loads(result.content)
+            parsed = json.loads(content)
             return GuardrailResult(
                 allowed=parsed["safe"],
                 reason=parsed.get("reason", ""),
             )
         except (json.JSONDecodeError, KeyError):
             # If we can't parse the safety check, block out of caution
-            return GuardrailResult(
-                allowed=False,
-                reason="Safety check produced an unparseable response; blocked as a precaution.",
-            )
+            return _UNPARSEABLE
 
 
 REFUSAL_MESSAGE = (
@@ -69,10 +347,49 @@ REFUSAL_MESSAGE = (
     "medical advice."
 )
 
+# additional_kwargs key set on the refusal message that replaces a blocked reply
+GUARDRAIL_TAG = "guardrail"
+
+
+def _refusal() -> AIMessage:
+    # Tagged so callers can tell it apart from a normal reply without comparing the text
+    return AIMessage(content=REFUSAL_MESSAGE, additional_kwargs={GUARDRAIL_TAG: "blocked"})
 
-def build_output_guard_node(llm):
-    """Return an output_guard node closure with the LLM captured."""
-    guardrail = OutputGuardrail(llm)
+
+# --- Streaming screen ---
+#
+# While the agent's reply streams in, each completed sentence goes to the local
+# classifier. Only a confident unsafe verdict stops the stream early; everything
+# else still gets the full-response evaluation in output_guard.
+
+_SENTENCE_ENDINGS = (".", "!", "?")
+
+
+def stream_screened(llm, messages: list, classifier: Callable[[str], Tuple[bool, float]]) -> AIMessage:
+    """Stream the LLM's reply, cancelling it with a refusal once a sentence is confidently unsafe."""
+    response = None
+    sentence = ""
+    stream = llm.stream(messages)
+    try:
+        for chunk in stream:
+            response = chunk if response is None else response + chunk
+            sentence += chunk.text
+            if not sentence.rstrip().endswith(_SENTENCE_ENDINGS):
+                continue
+            is_safe, confidence = classifier(sentence)
+            if not is_safe and confidence >= CLASSIFIER_BLOCK_CONFIDENCE:
+                return _refusal()
+            sentence = ""
+    finally:
+        # Closing the generator drops the HTTP stream, so no further tokens are decoded
+        stream.close()
+    # Store a plain AIMessage in graph state and checkpoints, not the accumulated chunk
+    return message_chunk_to_message(response) if response is not None else AIMessage(content="")
+
+
+def build_output_guard_node(llm=None, classifier=None, embeddings=None):
+    """Return an output_guard node closure with the LLM (and optional classifier) captured."""
+    guardrail = OutputGuardrail(llm, classifier, embeddings)
 
     def output_guard_node(state: MessagesState) -> dict:
         last = state["messages"][-1]
@@ -81,12 +398,16 @@ def build_output_guard_node(llm):
         if not isinstance(last, AIMessage) or last.tool_calls:
             return state
 
+        # Already replaced by the streaming screen
+        if last.additional_kwargs.get(GUARDRAIL_TAG) == "blocked":
+            return state
+
         result = guardrail.evaluate(last.content)
         if result.allowed:
             return state
 
         # Replace the unsafe response with a refusal
-        return {"messages": [AIMessage(content=REFUSAL_MESSAGE)]}
+        return {"messages": [_refusal()]}
 
     return output_guard_node
 
@@ -4,27 +4,82 @@ Provides regex-based redaction of emails, phone numbers, and SSNs,
 plus a tool wrapper that redacts PII from tool outputs before the LLM sees them.
 """
 
-import re
 from functools import wraps
 from langchain_core.tools import BaseTool
 
+try:
+    import re2 as re  # linear-time engine, immune to catastrophic backtracking
+except ImportError:
+    import re
+
 
 # --- Regex patterns ---
 
-_EMAIL_RE = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
-_SSN_RE = re.compile(r"\b\d{3}-\d{2}-\d{4}\b")
-_PHONE_RE = re.compile(
-    r"(\+?1[-.\s]?)?"           # optional country code
-    r"(\(?\d{3}\)?[-.\s]?)"     # area code
-    r"(\d{3}[-.\s]?\d{4})\b"    # subscriber number
+_SSN = r"(?P<SSN>\b\d{3}-\d{2}-\d{4}\b)"
+_EMAIL = r"(?P<EMAIL>[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)"
+_PHONE = (
+    r"(?P<PHONE>"
+    r"(?:\+?1[-.\s]?)?"             # optional country code
+    r"(?:\(?\d{3}\)?[-.\s]?)"       # area code
+    r"(?:\d{3}[-.\s]?\d{4})\b"      # subscriber number
+    r")"
 )
 
+# All PII classes are combined into one alternation so redact_pii() walks the
+# text once. Order matters: at a given position the first alternative wins.
+_PII_RE = re.compile(f"{_SSN}|{_EMAIL}|{_PHONE}")
+
+# Specialized variants for text that can only hold one kind of PII
+_EMAIL_RE = re.compile(_EMAIL)
+_NUMERIC_PII_RE = re.compile(f"{_SSN}|{_PHONE}")
+
+# Deleting digits runs entirely in C; a length change means the text had one
+_STRIP_DIGITS = str.maketrans("", "", "0123456789")
+
+_REPLACEMENTS = {
+    "SSN": "[SSN REDACTED]",
+    "EMAIL": "[EMAIL REDACTED]",
+    "PHONE": "[PHONE REDACTED]",
+}
+
+
+# Phone-shaped numbers right after one of these labels (possibly as the tail of
+# a longer identifier such as 978-... or 10.1000/...) are not phones
+_ID_LABEL_RE = re.compile(r"\b(?:ISBN|DOI)\b[:\s]*[\w./-]*$")
+_LABEL_WINDOW = 40
+
+
+def _is_phone_number(match) -> bool:
+    """Post-filter phone-shaped matches that are really ISBNs, DOIs, or #-numbers."""
+    digits = "".join(ch for ch in match.group() if ch.isdigit())
+    # NANP area and exchange codes never start with 0 or 1 (rules out 123-456-7890)
+    if digits[-10] in "01" or digits[-7] in "01":
+        return False
+    text, start = match.string, match.start()
+    # Only a leading "#" labels the number (Order #555...); a trailing one is an extension
+    if text[start - 1:start] == "#":
+        return False
+    return _ID_LABEL_RE.search(text[max(0, start - _LABEL_WINDOW):start]) is None
+
+
+def _replace(match) -> str:
+    kind = match.lastgroup
+    if kind == "PHONE" and not _is_phone_number(match):
+        return match.group()
+    return _REPLACEMENTS[kind]
+
 
 def redact_pii(text: str) -> str:
     """Replace emails, SSNs, and phone numbers with redaction placeholders."""
-    text = _SSN_RE.sub("[SSN REDACTED]", text)
-    text = _EMAIL_RE.sub("[EMAIL REDACTED]", text)
-    text = _PHONE_RE.sub("[PHONE REDACTED]", text)
+    # Emails need an "@" and SSNs/phones need digits; skip patterns that can't match
+    has_at = "@" in text
+    has_digit = len(text.translate(_STRIP_DIGITS)) != len(text)
+    if has_at and has_digit:
+        return _PII_RE.sub(_replace, text)
+    if has_at:
+        return _EMAIL_RE.sub(_replace, text)
+    if has_digit:
+        return _NUMERIC_PII_RE.sub(_replace, text)
     return text
 
 
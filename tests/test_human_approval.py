@@ -0,0 +1,102 @@
+import unittest
+from collections import Counter
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.tools import tool
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.types import Command
+
+from human_approval import build_graph
+
+CALLS = Counter()
+
+
+@tool
+def search_patient(query: str) -> str:
+    """Search patient records."""
+    CALLS["search_patient"] += 1
+    return f"results for {query}"
+
+
+@tool
+def send_email(to: str, body: str) -> str:
+    """Send an email."""
+    CALLS["send_email"] += 1
+    return f"sent to {to}"
+
+
+class ScriptedLLM:
+    """Agent LLM returning canned replies; as the safety LLM it approves everything."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def bind_tools(self, tools):
+        return self
+
+    def invoke(self, messages):
+        return self.replies.pop(0)
+
+    def batch(self, inputs):
+        return [AIMessage(content='{"safe": true, "reason": "ok"}') for _ in inputs]
+
+
+def _tool_call(name, args, call_id):
+    return {"name": name, "args": args, "id": call_id, "type": "tool_call"}
+
+
+MIXED_BATCH = AIMessage(content="", tool_calls=[
+    _tool_call("search_patient", {"query": "Jane"}, "safe-1"),
+    _tool_call("send_email", {"to": "jane@example.com", "body": "hi"}, "sensitive-1"),
+])
+
+
+class MixedBatchApprovalTest(unittest.TestCase):
+    def setUp(self):
+        CALLS.clear()
+        llm = ScriptedLLM([MIXED_BATCH, AIMessage(content="Done.")])
+        self.graph = build_graph([search_patient, send_email], llm, MemorySaver(), safety_llm=llm)
+        self.config = {"configurable": {"thread_id": self.id()}}
+
+    def _start(self):
+        return self.graph.invoke({"messages": [HumanMessage(content="Email Jane's record")]}, self.config)
+
+    def _tool_messages(self, result):
+        return {m.tool_call_id: m.content for m in result["messages"] if isinstance(m, ToolMessage)}
+
+    def test_safe_calls_run_before_the_decision(self):
+        result = self._start()
+        self.assertEqual(len(result["__interrupt__"]), 1)
+        self.assertEqual(
+            [tc["name"] for tc in result["__interrupt__"][0].value["tool_calls"]],
+            ["send_email"],
+        )
+        self.assertEqual(CALLS, Counter(search_patient=1))
+
+    def test_approve_runs_sensitive_calls_once(self):
+        self._start()
+        result = self.graph.invoke(Command(resume="approve"), self.config)
+        self.assertNotIn("__interrupt__", result)
+        self.assertEqual(CALLS, Counter(search_patient=1, send_email=1))
+        self.assertEqual(set(self._tool_messages(result)), {"safe-1", "sensitive-1"})
+        self.assertEqual(result["messages"][-1].content, "Done.")
+
+    def test_reject_skips_only_sensitive_calls(self):
+        self._start()
+        result = self.graph.invoke(Command(resume="reject"), self.config)
+        self.assertEqual(CALLS, Counter(search_patient=1))
+        tool_messages = self._tool_messages(result)
+        self.assertEqual(tool_messages["safe-1"], "results for Jane")
+        self.assertIn("rejected", tool_messages["sensitive-1"])
+        self.assertEqual(result["messages"][-1].content, "Done.")
+
+    def test_approve_all_mode_skips_the_interrupt(self):
+        self.config["configurable"]["approval_mode"] = "approve_all"
+        result = self._start()
+        self.assertNotIn("__interrupt__", result)
+        self.assertEqual(CALLS, Counter(search_patient=1, send_email=1))
+        self.assertEqual(result["messages"][-1].content, "Done.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+
+from output_guardrail import (
+    GUARDRAIL_TAG,
+    REFUSAL_MESSAGE,
+    OutputGuardrail,
+    dosage_without_citation,
+    stream_screened,
+)
+
+SAFE = '{"safe": true, "reason": "ok"}'
+UNSAFE = '{"safe": false, "reason": "harmful"}'
+
+
+class ScriptedLLM:
+    """Safety LLM answering each evaluation with the next canned reply."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.evaluated = []
+
+    def batch(self, inputs):
+        self.evaluated.extend(messages[-1].content for messages in inputs)
+        return [AIMessage(content=self.replies.pop(0)) for _ in inputs]
+
+
+class FakeEmbeddings:
+    """Embeds the text before any "|" as a fixed one-hot vector, so "a|x" and "a|y" match."""
+
+    AXES = {"a": 0, "b": 1, "c": 2, "d": 3}
+
+    def embed_query(self, text):
+        vector = [0.0] * len(self.AXES)
+        vector[self.AXES[text.split("|")[0]]] = 2.0
+        return vector
+
+
+class ScoringTest(unittest.TestCase):
+    def test_rule_failures_block_without_the_llm(self):
+        llm = ScriptedLLM([])
+        result = OutputGuardrail(llm).evaluate(
+            "Crush the tablets and take 60mg. No need to see a doctor. Email jane@example.com."
+        )
+        self.assertFalse(result.allowed)
+        self.assertEqual(result.reason, "Failed compliance check: disallowed_terms.")
+        self.assertEqual(llm.evaluated, [])
+
+    def test_inconclusive_rules_ask_the_llm(self):
+        llm = ScriptedLLM([UNSAFE])
+        result = OutputGuardrail(llm).evaluate("Rest and drink fluids.")
+        self.assertFalse(result.allowed)
+        self.assertEqual(len(llm.evaluated), 1)
+
+    def test_confident_classifier_decides_both_ways(self):
+        llm = ScriptedLLM([])
+        self.assertTrue(OutputGuardrail(llm, classifier=lambda text: (True, 0.99)).evaluate("Rest.").allowed)
+        unsafe = OutputGuardrail(llm, classifier=lambda text: (False, 0.99)).evaluate("Rest.")
+        self.assertEqual(unsafe.reason, "Failed compliance check: safety_classifier.")
+        self.assertEqual(llm.evaluated, [])
+
+    def test_citations_need_upper_case_acronyms(self):
+        self.assertEqual(dosage_without_citation("Take 80mg of oxycodone every hour."), 0.0)
+        self.assertEqual(dosage_without_citation("Anyone who has pain should take 80mg."), 0.0)
+        self.assertEqual(dosage_without_citation("Per WHO guidance, take 80mg."), 1.0)
+        self.assertEqual(dosage_without_citation("According to the label, take 80mg."), 1.0)
+
+
+class VerdictCacheTest(unittest.TestCase):
+    def test_exact_cache_is_lru(self):
+        llm = ScriptedLLM([SAFE, SAFE, SAFE, SAFE])
+        guard = OutputGuardrail(llm, cache_size=2)
+        guard.evaluate("one.")
+        guard.evaluate("two.")
+        guard.evaluate("one.")  # hit; "two." is now least recently used
+        guard.evaluate("three.")  # evicts "two."
+        guard.evaluate("one.")
+        guard.evaluate("two.")
+        self.assertEqual(len(llm.evaluated), 4)
+
+    def test_unparseable_reply_is_not_cached(self):
+        llm = ScriptedLLM(["not json", SAFE])
+        guard = OutputGuardrail(llm)
+        self.assertFalse(guard.evaluate("Rest.").allowed)
+        self.assertTrue(guard.evaluate("Rest.").allowed)
+        self.assertEqual(len(llm.evaluated), 2)
+
+    def test_semantic_hit_reuses_a_similar_verdict(self):
+        llm = ScriptedLLM([UNSAFE])
+        guard = OutputGuardrail(llm, embeddings=FakeEmbeddings())
+        guard.evaluate("a|first wording")
+        result = guard.evaluate("a|second wording")
+        self.assertFalse(result.allowed)
+        self.assertEqual(len(llm.evaluated), 1)
+
+    def test_semantic_cache_evicts_oldest_vector(self):
+        llm = ScriptedLLM([SAFE] * 5)
+        guard = OutputGuardrail(llm, embeddings=FakeEmbeddings(), cache_size=2)
+        for text in ("a|1", "b|1", "c|1"):
+            guard.evaluate(text)
+        guard.evaluate("c|2")  # still cached
+        guard.evaluate("a|2")  # evicted by "c|1"
+        self.assertEqual(len(llm.evaluated), 4)
+
+
+class StreamingLLM:
+    """Streams canned text one word at a time and records how far it got."""
+
+    def __init__(self, text):
+        self.words = text.split(" ")
+        self.streamed = 0
+        self.closed = False
+
+    def stream(self, messages):
+        try:
+            for word in self.words:
+                self.streamed += 1
+                yield AIMessageChunk(content=word + " ")
+        finally:
+            self.closed = True
+
+
+def keyword_classifier(text):
+    """Confidently unsafe whenever the text mentions bleach."""
+    return "bleach" not in text, 0.99
+
+
+class StreamScreenedTest(unittest.TestCase):
+    def test_safe_reply_passes_through_as_a_message(self):
+        llm = StreamingLLM("Rest well. Drink fluids. See a doctor.")
+        reply = stream_screened(llm, [HumanMessage(content="hi")], keyword_classifier)
+        self.assertIs(type(reply), AIMessage)
+        self.assertEqual(reply.content, "Rest well. Drink fluids. See a doctor. ")
+        self.assertNotIn(GUARDRAIL_TAG, reply.additional_kwargs)
+        self.assertEqual(llm.streamed, len(llm.words))
+
+    def test_unsafe_sentence_cancels_the_stream(self):
+        llm = StreamingLLM("Rest well. Drink bleach daily. More text follows here.")
+        reply = stream_screened(llm, [HumanMessage(content="hi")], keyword_classifier)
+        self.assertEqual(reply.content, REFUSAL_MESSAGE)
+        self.assertEqual(reply.additional_kwargs[GUARDRAIL_TAG], "blocked")
+        self.assertTrue(llm.closed)
+        self.assertEqual(llm.streamed, 5)
+
+    def test_unsure_classifier_does_not_cancel(self):
+        llm = StreamingLLM("Drink bleach daily.")
+        reply = stream_screened(llm, [HumanMessage(content="hi")], lambda text: (False, 0.6))
+        self.assertEqual(reply.content, "Drink bleach daily. ")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from pii_middleware import redact_pii
+
+
+class RedactPhoneTest(unittest.TestCase):
+    def test_redacts_phone_near_words_containing_doi(self):
+        self.assertEqual(
+            redact_pii("I'm doing fine, call me at 555-867-5309"),
+            "I'm doing fine, call me at [PHONE REDACTED]",
+        )
+
+    def test_redacts_phone_near_unrelated_hash(self):
+        self.assertEqual(
+            redact_pii("Patient #P001, phone 555-867-5309"),
+            "Patient #P001, phone [PHONE REDACTED]",
+        )
+
+    def test_redacts_phone_with_hash_extension(self):
+        self.assertEqual(
+            redact_pii("Call 555-867-5309#4 for the nurse line"),
+            "Call [PHONE REDACTED]#4 for the nurse line",
+        )
+
+    def test_keeps_labelled_identifiers(self):
+        for text in (
+            "ISBN 978-555-867-5309",
+            "DOI: 10.1000/555-867-5309",
+            "Order #555-867-5309",
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(redact_pii(text), text)
+
+    def test_label_only_covers_the_number_it_precedes(self):
+        self.assertEqual(
+            redact_pii("ISBN 555-867-5309, or call 555-234-5678"),
+            "ISBN 555-867-5309, or call [PHONE REDACTED]",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()